@@ -5,6 +5,7 @@ Main entrypoint for the training and testing environments. Takes in a configurat
 of arguments and either trains a model or tests a given model and checkpoint.
 """
 import hydra
+import torch
 import pytorch_lightning
 import pytorch_lightning.loggers as pl_loggers
 
@@ -35,6 +36,10 @@ def main(cfg: DictConfig):
     early_stop_callback = EarlyStopping(monitor="val_reconstruction_mse", min_delta=0.000001, patience=15, mode="min")
     lr_monitor = LearningRateMonitor(logging_interval='step')
 
+    # Allow enough cached compiled graphs to absorb the handful of generation lengths seen across train/val/test
+    if cfg.training.compile is True:
+        torch._dynamo.config.cache_size_limit = 32
+
     # Initialize trainer
     trainer = pytorch_lightning.Trainer(
         callbacks=[
@@ -43,6 +48,7 @@ def main(cfg: DictConfig):
             checkpoint_callback
         ],
         accelerator=cfg.training.accelerator,
+        precision=cfg.training.precision,
         deterministic=True,
         max_steps=cfg.training.num_steps * cfg.training.batch_size,
         max_epochs=1,
@@ -8,15 +8,16 @@ import os
 import json
 import torch
 import numpy as np
-import torch.nn as nn
+import torch.nn.functional as F
 import pytorch_lightning
 import utils.metrics as metrics
 import matplotlib.pyplot as plt
 
-from sklearn.manifold import TSNE
+from matplotlib.lines import Line2D
+from concurrent.futures import ThreadPoolExecutor
 from models.CommonVAE import LatentStateEncoder, EmissionDecoder
 from utils.plotting import show_images, get_embedding_trajectories
-from utils.utils import determine_annealing_factor, CosineAnnealingWarmRestartsWithDecayAndLinearWarmup
+from utils.utils import determine_annealing_factor, fit_tsne, CosineAnnealingWarmRestartsWithDecayAndLinearWarmup
 
 
 class LatentDynamicsModel(pytorch_lightning.LightningModule):
@@ -39,16 +40,33 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         self.dynamics_func = None
         self.dynamics_out = None
 
-        # Number of steps for training
+        # Whether the submodules have been compiled in configure_model
+        self._compiled = False
+
+        # Number of steps for training and the KL annealing factor over them
         self.n_updates = 0
+        self._kl_schedule = None
+
+        # Generator for subsequence sampling, seeded off the global NumPy state so seed_everything still applies
+        self._rng = np.random.default_rng(np.random.randint(2 ** 31))
+        self._rand_genlens = None
+        self._rand_start_fracs = None
 
-        # Loss function
-        self.reconstruction_loss = nn.MSELoss(reduction='none')
+        # Metric functions to evaluate, resolved once by name
+        self._metric_fns = [(met, getattr(metrics, met)) for met in cfg.training.metrics]
 
         self.outputs = list()
         self.validation_step_outputs = list()
         self.batch_outputs = list()
 
+        # Pinned host staging buffers that saved batch outputs are asynchronously copied through, alongside the
+        # most recently staged batch of each setting that is still waiting to be moved out of them
+        self._pinned_cache = dict()
+        self._staged = dict()
+
+        # Host buffer that the side-by-side reconstruction images are built in
+        self._montage_buf = None
+
     def forward(self, x, generation_len):
         """ Placeholder function for the dynamics forward pass """
         raise NotImplementedError("In forward function: Latent Dynamics function not specified.")
@@ -95,6 +113,28 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         # Otherwise just return the optimizer
         return optim
 
+    def configure_model(self):
+        """
+        Compiles the VAE components and dynamics function in-place once the subclass has bound them, rather than
+        the LightningModule as a whole. Compiling in-place keeps their state_dict keys unchanged and the metric
+        functions stay outside of the compiled regions. Repeated calls across fit/test are no-ops.
+        """
+        if self._compiled or self.cfg.training.compile is False:
+            return
+
+        # The VAE components get CUDA graphs. The encoder only sees the fixed z_amort frames, but the decoder takes
+        # [BatchSize * GenerationLen, LatentSize], so it records a graph per train/val/test length and partial batch.
+        # The dynamics rollout is traced once with dynamic shapes to avoid recompiling for every generation length
+        self.encoder.compile(mode='reduce-overhead')
+        self.decoder.compile(mode='reduce-overhead')
+        if self.dynamics_func is not None:
+            self.dynamics_func.compile(mode='default', dynamic=True)
+        self._compiled = True
+
+    def optimizer_zero_grad(self, epoch, batch_idx, optimizer):
+        """ Dereferences the gradients between steps rather than writing zeros into every gradient tensor """
+        optimizer.zero_grad(set_to_none=True)
+
     def on_train_start(self):
         """
         Before a training session starts, we set some model variables and save a JSON configuration of the
@@ -104,33 +144,151 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         self.log("total_num_parameters", float(sum(p.numel() for p in self.parameters() if p.requires_grad)), prog_bar=False)
 
         # Make image dir in lightning experiment folder if it doesn't exist
-        if not os.path.exists(f"{self.logger.log_dir}/images/"):
-            os.mkdir(f"{self.logger.log_dir}/images/")
+        os.makedirs(f"{self.logger.log_dir}/images/", exist_ok=True)
+
+        # Preallocate the reconstruction image buffer for the longest train/val sequence and 5 samples
+        dim, max_len = self.cfg.model.architecture.dim, max(self.cfg.training.gen_len['train'], self.cfg.training.gen_len['val'])
+        self._montage_buf = np.empty(5 * 2 * (dim + 10) * max_len * (dim + 1), dtype=np.float32)
+
+        # Precompute the KL annealing schedule, which stays at its final value past the last entry
+        self._kl_schedule = np.array([determine_annealing_factor(n, anneal_update=1000) for n in range(1001)])
+
+    def stage_to_host(self, tensor, key=None):
+        """
+        Issues a non-blocking device->host copy of a detached tensor into pinned memory, such that the copy
+        overlaps with the rest of the step rather than synchronizing the stream on a .cpu() call.
+        Buffers are reused across steps when given a cache key, only growing when a larger tensor comes in.
+        :param tensor: GPU tensor to copy to the host
+        :param key: optional key to reuse a cached pinned buffer under
+        :return: host tensor that holds the copy once the stream has been synchronized
+        """
+        tensor = tensor.detach()
+        if not tensor.is_cuda:
+            return tensor
+
+        # Get a flat pinned buffer large enough for the tensor, allocating one if none is cached
+        buffer = self._pinned_cache.get(key)
+        if buffer is None or buffer.numel() < tensor.numel() or buffer.dtype != tensor.dtype:
+            buffer = torch.empty(tensor.numel(), dtype=tensor.dtype, pin_memory=True)
+            if key is not None:
+                self._pinned_cache[key] = buffer
+
+        staged = buffer[:tensor.numel()].view(tensor.shape)
+        staged.copy_(tensor, non_blocking=True)
+        return staged
+
+    def stage_outputs(self, out, setting, slot):
+        """
+        Copies a saved batch's predictions and images to the host through one of two alternating pinned buffers
+        per setting, first moving the previously staged batch out of its buffers. Only two batches per setting are
+        ever page-locked, while the copies still overlap with the following step
+        :param out: dictionary of saved outputs, updated in-place with the host tensors
+        :param setting: which of train/val the outputs are saved for
+        :param slot: index of the batch within the saved outputs
+        """
+        self.collect_staged(setting)
+        for key in ("preds", "images"):
+            out[key] = self.stage_to_host(out[key], key=(setting, slot % 2, key))
+
+        copy_event = None
+        if torch.cuda.is_available():
+            copy_event = torch.cuda.Event()
+            copy_event.record()
+        self._staged[setting] = (out, copy_event)
+
+    def collect_staged(self, setting):
+        """
+        Moves the batch last staged for the given setting out of the reused pinned buffers into pageable host memory
+        once its device->host copies have landed
+        :param setting: which of train/val to collect the staged batch for
+        """
+        staged = self._staged.pop(setting, None)
+        if staged is None:
+            return
+
+        out, copy_event = staged
+        if copy_event is not None:
+            copy_event.synchronize()
+
+        for key in ("preds", "images"):
+            if out[key].is_pinned():
+                out[key] = out[key].clone()
+
+    def on_fit_end(self):
+        """ Frees the pinned staging buffers, such that no page-locked host memory is held past training """
+        self._staged = dict()
+        self._pinned_cache = dict()
+
+    def on_test_end(self):
+        """ Frees the pinned staging buffers, such that no page-locked host memory is held between test runs """
+        self._staged = dict()
+        self._pinned_cache = dict()
+
+    def on_train_epoch_start(self):
+        """
+        Draws the generation lengths and subsequence start points for every batch of the epoch at once,
+        rather than sampling them one at a time on each step
+        """
+        n_batches = int(self.trainer.num_training_batches)
+
+        # Get the generation lengths - either fixed or random between [1,T] depending on flags
+        if self.cfg.training.gen_len['varying'] is True:
+            self._rand_genlens = self._rng.integers(1, self.cfg.training.gen_len['train'], size=n_batches)
+        else:
+            self._rand_genlens = np.full(n_batches, self.cfg.training.gen_len['train'])
+
+        # Start points are drawn as fractions of the valid range, as that range depends on the generation length
+        self._rand_start_fracs = self._rng.random(size=n_batches)
 
-    def get_step_outputs(self, batch, generation_len):
+    def encode_cached(self, tensor):
+        """
+        Converts a detached tensor of [0,1] images into the configured cache dtype before it gets held in the
+        output caches, trading precision on the saved copies for less memory and less device->host traffic
+        :param tensor: images or predictions [BatchSize, GenerationLen, H, W]
+        """
+        tensor = tensor.detach()
+        if self.cfg.training.cache_dtype == 'uint8':
+            return (tensor.clamp(0, 1) * 255).round().to(torch.uint8)
+        return tensor.to(getattr(torch, self.cfg.training.cache_dtype))
+
+    @staticmethod
+    def decode_cached(tensor):
+        """ Reverts a tensor from the output caches back into FP32 images in [0,1] """
+        if tensor.dtype == torch.uint8:
+            return tensor.float() / 255.0
+        return tensor.float()
+
+    def get_step_outputs(self, batch, generation_len, start_frac=None):
         """
         Handles the process of pre-processing and subsequence sampling a batch,
         as well as getting the outputs from the models regardless of step
         :param batch: list of dictionary objects representing a single image
         :param generation_len: how far out to generate for, dependent on the step (train/val)
+        :param start_frac: pre-drawn fraction in [0, 1) of the valid start range. If None, one is sampled
         :return: processed model outputs
         """
         # Deconstruct batch
         _, images, states, controls, labels = batch
 
         # Same random portion of the sequence over generation_len, saving room for backwards solving
-        random_start = np.random.randint(generation_len, images.shape[1] - self.cfg.training.z_amort - generation_len)
-
-        # Get forward sequences
-        images = images[:, random_start:random_start + generation_len + self.cfg.training.z_amort]
-        states = states[:, random_start:random_start + generation_len + self.cfg.training.z_amort]
-
-        # Get predictions
+        low, high = generation_len, images.shape[1] - self.cfg.training.z_amort - generation_len
+        if start_frac is None:
+            random_start = int(self._rng.integers(low, high))
+        else:
+            random_start = low + int(start_frac * (high - low))
+
+        # Get forward sequences as views over the shared window
+        z_amort = self.cfg.training.z_amort
+        images = images.narrow(1, random_start, generation_len + z_amort)
+        states = states.narrow(1, random_start, generation_len + z_amort)
+
+        # Get predictions, returned in FP32 regardless of autocast so they can be logged and converted to Numpy
         preds, embeddings = self(images, generation_len)
+        preds, embeddings = preds.float(), embeddings.float()
 
         # Restrict images to start from after inference, for metrics and likelihood
-        images = images[:, self.cfg.training.z_amort:]
-        states = states[:, self.cfg.training.z_amort:]
+        images = images.narrow(1, z_amort, generation_len)
+        states = states.narrow(1, z_amort, generation_len)
         return images, states, labels, preds, embeddings
 
     def get_step_losses(self, images, preds):
@@ -141,9 +299,10 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         :param preds: forward predictions from the model
         :return: likelihood, kl on z0, model-specific dynamics loss
         """
-        # Reconstruction loss for the sequence and z0
-        likelihood = self.reconstruction_loss(preds, images)
-        likelihood = likelihood.reshape([likelihood.shape[0] * likelihood.shape[1], -1]).sum([-1]).mean()
+        # Reconstruction loss for the sequence and z0, summed per frame and averaged over batch and time
+        # The sum runs over every pixel, so it is kept in FP32 even when training under bf16 mixed precision
+        with torch.autocast(device_type=preds.device.type, enabled=False):
+            likelihood = F.mse_loss(preds.float(), images.float(), reduction='sum') / (images.shape[0] * images.shape[1])
 
         # Initial encoder loss, KL[q(z_K|x_0:K) || p(z_K)]
         klz = self.encoder.kl_z_term()
@@ -158,15 +317,28 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         :param outputs: list of dictionaries with outputs from each back
         :return: dictionary of metrics aggregated over the epoch
         """
-        # Convert outputs to Tensors and then Numpy arrays
-        images = torch.vstack([out["images"] for out in outputs]).cpu().numpy()
-        preds = torch.vstack([out["preds"] for out in outputs]).cpu().numpy()
+        # Wait on the pending host copies, then concatenate the saved batches
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+        images = self.decode_cached(torch.cat([out["images"] for out in outputs], dim=0))
+        preds = self.decode_cached(torch.cat([out["preds"] for out in outputs], dim=0))
+
+        # Per-frame MSE is reduced once and sliced by the reconstruction and extrapolation metrics
+        frame_mse = metrics.frame_mse(images, preds)
 
         # Iterate through each metric function and add to a dictionary
+        # Torch-native metrics take the tensors as-is, while the rest share a single conversion to Numpy
         out_metrics = {}
-        for met in self.cfg.training.metrics:
-            metric_function = getattr(metrics, met)
-            out_metrics[met] = metric_function(images, preds, cfg=self.cfg, setting=setting)[0]
+        images_np, preds_np = None, None
+        for met, metric_function in self._metric_fns:
+            if met in metrics.TORCH_METRICS:
+                out_metrics[met] = metric_function(images, preds, cfg=self.cfg, setting=setting, frame_mse=frame_mse)[0]
+                continue
+
+            if images_np is None:
+                images_np, preds_np = images.cpu().numpy(), preds.cpu().numpy()
+            out_metrics[met] = metric_function(images_np, preds_np, cfg=self.cfg, setting=setting)[0]
 
         # Return a dictionary of metrics
         return out_metrics
@@ -178,18 +350,17 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         :param batch: list of dictionary objects representing a single image
         :param batch_idx: how far in the epoch this batch is
         """
-        # Get the generation length - either fixed or random between [1,T] depending on flags
-        generation_len = np.random.randint(1, self.cfg.training.gen_len['train']) \
-            if self.cfg.training.gen_len['varying'] is True else self.cfg.training.gen_len['train']
+        # Get the generation length drawn for this batch at the start of the epoch
+        generation_len = int(self._rand_genlens[batch_idx])
 
         # Get model outputs from batch
-        images, states, labels, preds, embeddings = self.get_step_outputs(batch, generation_len)
+        images, states, labels, preds, embeddings = self.get_step_outputs(batch, generation_len, self._rand_start_fracs[batch_idx])
 
         # Get model loss terms for the step
         likelihood, klz, dynamics_loss = self.get_step_losses(images, preds)
 
-        # Determine KL annealing factor for the current step
-        kl_factor = determine_annealing_factor(self.n_updates, anneal_update=1000)
+        # Look up the KL annealing factor for the current step
+        kl_factor = float(self._kl_schedule[min(self.n_updates, len(self._kl_schedule) - 1)])
 
         # Build the full loss
         loss = likelihood + kl_factor * ((self.cfg.training.betas.z0 * klz) + (self.cfg.training.betas.kl * dynamics_loss))
@@ -202,25 +373,33 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
             "kl_factor": kl_factor
         })
 
-        # Return outputs as dict
+        # Return outputs as dict, only holding onto the batches that get used for the logging window
         self.n_updates += 1
-        out = {"loss": loss, "labels": labels.detach(), "preds": preds.detach(), "images": images.detach()}
+        slot = len(self.outputs)
+        if slot >= self.cfg.dataset.batches_to_save:
+            return {"loss": loss}
+
+        # The cached copy holds a detached loss such that the step's autograd graph isn't kept alive
+        out = {"loss": loss.detach(), "labels": labels,
+               "preds": self.encode_cached(preds), "images": self.encode_cached(images)}
+        self.stage_outputs(out, "train", slot)
         self.outputs.append(out)
-        return out
+        return {"loss": loss}
 
     def on_train_batch_end(self, outputs, batch, batch_idx):
         """ Given the iterative training, check on every batch's end whether it is evaluation time or not """
         if batch_idx % self.cfg.training.log_interval == 0 and batch_idx != 0:
             # Log epoch metrics on saved batches
-            metrics = self.get_epoch_metrics(self.outputs[:self.cfg.dataset.batches_to_save], setting='train')
+            self.collect_staged("train")
+            metrics = self.get_epoch_metrics(self.outputs, setting='train')
             for metric in metrics.keys():
                 self.log(f"train_{metric}", metrics[metric], prog_bar=True)
 
             # Every 10 windows of updates, get images from train
             if batch_idx % (self.cfg.training.log_interval * 10) == 0 and batch_idx != 0:
                 # Show side-by-side reconstructions
-                show_images(self.outputs[0]["images"], self.outputs[0]["preds"],
-                            f'{self.logger.log_dir}/images/recon{batch_idx}train.png', num_out=5)
+                show_images(self.decode_cached(self.outputs[0]["images"]), self.decode_cached(self.outputs[0]["preds"]),
+                            f'{self.logger.log_dir}/images/recon{batch_idx}train.png', num_out=5, out=self._montage_buf)
 
                 # Get per-dynamics plots
                 self.model_specific_plotting(self.logger.log_dir, self.outputs)
@@ -246,12 +425,12 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         # Log validation likelihood and metrics
         self.log("val_likelihood", likelihood, prog_bar=True)
 
-        # Return outputs as dict
-        out = {"loss": loss}
+        # Return outputs as dict, only holding onto the batches that get used for metrics
+        out = {"loss": loss.detach()}
         if batch_idx < self.cfg.dataset.batches_to_save:
-            out["preds"] = preds.detach()
-            out["images"] = images.detach()
-        self.validation_step_outputs.append(out)
+            out["preds"], out["images"] = self.encode_cached(preds), self.encode_cached(images)
+            self.stage_outputs(out, "val", batch_idx)
+            self.validation_step_outputs.append(out)
         return out
 
     def on_validation_epoch_end(self):
@@ -259,17 +438,78 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         Every N epochs, get a validation reconstruction sample
         """
         # Log epoch metrics on saved batches
-        metrics = self.get_epoch_metrics(self.validation_step_outputs[:self.cfg.dataset.batches_to_save], setting='val')
+        self.collect_staged("val")
+        metrics = self.get_epoch_metrics(self.validation_step_outputs, setting='val')
         for metric in metrics.keys():
             self.log(f"val_{metric}", metrics[metric], prog_bar=True)
 
         # Get image reconstructions
-        show_images(self.validation_step_outputs[0]["images"], self.validation_step_outputs[0]["preds"],
-          
-                    f'{self.logger.log_dir}/images/recon{self.n_updates}val.png', num_out=5)
-        # Clear out the old cache            
+        show_images(self.decode_cached(self.validation_step_outputs[0]["images"]),
+                    self.decode_cached(self.validation_step_outputs[0]["preds"]),
+                    f'{self.logger.log_dir}/images/recon{self.n_updates}val.png', num_out=5, out=self._montage_buf)
+
+        # Clear out the old cache
         self.validation_step_outputs = list()
 
+    def on_test_start(self):
+        """
+        Before testing, set up the output folder and, when saving files, the state for streaming each test batch's
+        predictions, images, and labels into .npy memory maps as the batches come in
+        """
+        self._test_output_path = f"{self.logger.log_dir}/test_{self.setting}"
+        os.makedirs(self._test_output_path, exist_ok=True)
+
+        self._test_memmaps = dict()
+        self._test_pending = None
+        self._test_num_written = 0
+
+    def collect_test_outputs(self, out):
+        """
+        Moves the previously queued test batch out of the reused pinned staging buffers into pageable host memory,
+        writing it to disk when saving files, then queues the given batch. The previous batch's copies were issued
+        a full step ago, so waiting on them rarely stalls the stream
+        :param out: dictionary of staged host tensors from the test step. If None, only flushes the queued batch
+        """
+        if self._test_pending is not None:
+            pending, copy_event = self._test_pending
+            if copy_event is not None:
+                copy_event.synchronize()
+
+            # Saved predictions and images go straight from the staging buffers to disk and are not held in memory
+            if self.cfg.save_files is True:
+                self.write_test_outputs(pending)
+                pending = {key: value for key, value in pending.items() if key not in ("preds", "images")}
+
+            # The staging buffers get reused two steps later, so their contents are copied out here
+            pending = {key: value.clone() if value.is_pinned() else value for key, value in pending.items()}
+            self.batch_outputs.append(pending)
+
+        # Queue the given batch, marking when its copies were issued
+        copy_event = None
+        if out is not None and torch.cuda.is_available():
+            copy_event = torch.cuda.Event()
+            copy_event.record()
+        self._test_pending = (out, copy_event) if out is not None else None
+
+    def write_test_outputs(self, out):
+        """
+        Writes a test batch's predictions, images, and labels into their .npy memory maps
+        :param out: dictionary of host tensors from the test step
+        """
+        for key, name in (("preds", "recons"), ("images", "images"), ("labels", "labels")):
+            array = out[key].numpy()
+
+            # Open the memory map on the first batch, sized over the full test set
+            if key not in self._test_memmaps:
+                num_samples = len(self.trainer.test_dataloaders.dataset)
+                self._test_memmaps[key] = np.lib.format.open_memmap(
+                    f"{self._test_output_path}/test_{self.setting}_{name}.npy", mode='w+',
+                    dtype=array.dtype, shape=(num_samples,) + array.shape[1:]
+                )
+
+            self._test_memmaps[key][self._test_num_written:self._test_num_written + array.shape[0]] = array
+        self._test_num_written += out["preds"].shape[0]
+
     def test_step(self, batch, batch_idx):
         """
         PyTorch-Lightning testing step.
@@ -279,61 +519,79 @@ class LatentDynamicsModel(pytorch_lightning.LightningModule):
         # Get model outputs from batch
         images, states, labels, preds, embeddings = self.get_step_outputs(batch, self.cfg.training.gen_len['test'])
 
-        # Build output dictionary
-        out = {"states": states.detach().cpu(), "embeddings": embeddings.detach().cpu(),
-               "preds": preds.detach().cpu(), "images": images.detach().cpu(), "labels": labels.detach().cpu()}
-        self.batch_outputs.append(out)
-        return out
+        # Per-frame MSE is reduced on the device per batch, so the metrics don't need every prediction held at once
+        frame_mse = metrics.frame_mse(images, preds)
+
+        # Asynchronously copy each tensor into one of two alternating pinned staging buffers, such that only two
+        # batches are ever page-locked, and collect the previous batch while these copies run
+        out = {key: self.stage_to_host(tensor, key=("test", batch_idx % 2, key)) for key, tensor in
+               (("states", states), ("embeddings", embeddings), ("preds", preds), ("images", images),
+                ("labels", labels), ("frame_mse", frame_mse))}
+        self.collect_test_outputs(out)
 
     def on_test_epoch_end(self):
         """
         For testing end, save the predictions, gt, and MSE to NPY files in the respective experiment folder
         :param outputs: list of outputs from the validation steps at batch 0
         """
-        # Stack all output types and convert to numpy
-        outputs = dict()
-        for key in self.batch_outputs[0].keys():
-            stack_method = torch.concatenate if key == "som_assignments" else torch.vstack
-            outputs[key] = stack_method([output[key] for output in self.batch_outputs]).numpy()
+        # Collect the last queued batch and flush the saved files to disk
+        self.collect_test_outputs(None)
+        if self.cfg.save_files is True:
+            for memmap in self._test_memmaps.values():
+                memmap.flush()
+            self._test_memmaps = dict()
+
+        # Concatenate all output types over the batch dimension and convert to numpy
+        outputs = {
+            key: torch.cat([output[key] for output in self.batch_outputs], dim=0).numpy()
+            for key in self.batch_outputs[0].keys()
+        }
+
+        # Saved predictions and images are read back from disk as memory maps rather than held in memory
+        # They are copy-on-write, as some metrics (e.g. the thresholding in dst/vpd) binarize the images in-place
+        if self.cfg.save_files is True:
+            outputs["preds"] = np.load(f"{self._test_output_path}/test_{self.setting}_recons.npy", mmap_mode='c')
+            outputs["images"] = np.load(f"{self._test_output_path}/test_{self.setting}_images.npy", mmap_mode='c')
 
-        # Iterate through each metric function and add to a dictionary
+        # Iterate through each metric function and add to a dictionary, sharing the per-batch per-frame MSE
         out_metrics = {}
-        for met in self.cfg.training.metrics:
-            metric_function = getattr(metrics, met)
-            metric_mean, metric_std = metric_function(outputs["images"], outputs["preds"], cfg=self.cfg, setting='test')
+        for met, metric_function in self._metric_fns:
+            metric_mean, metric_std = metric_function(outputs["images"], outputs["preds"], cfg=self.cfg, setting='test', frame_mse=outputs["frame_mse"])
             out_metrics[f"{met}_mean"], out_metrics[f"{met}_std"] = float(metric_mean), float(metric_std)
             print(f"=> {met}: {metric_mean:4.5f}+-{metric_std:4.5f}")
 
-        # Set up output path and create dir
-        output_path = f"{self.logger.log_dir}/test_{self.setting}"
-        if not os.path.exists(output_path):
-            os.mkdir(output_path)
+        output_path = self._test_output_path
 
-        # Save files
-        if self.cfg.save_files is True:
-            np.save(f"{output_path}/test_{self.setting}_recons.npy", outputs["preds"])
-            np.save(f"{output_path}/test_{self.setting}_images.npy", outputs["images"])
-            np.save(f"{output_path}/test_{self.setting}_labels.npy", outputs["labels"])
+        # Offload the example image and the TSNE fit to worker threads, overlapping them with the main-thread plotting
+        with ThreadPoolExecutor() as executor:
+            futures = []
+
+            # Save some examples
+            futures.append(executor.submit(show_images, outputs["images"][:10], outputs["preds"][:10],
+                                           f"{output_path}/test_{self.setting}_examples.png", num_out=5))
 
-        # Save some examples
-        show_images(outputs["images"][:10], outputs["preds"][:10], f"{output_path}/test_{self.setting}_examples.png", num_out=5)
+            # Get Z0 TSNE
+            tsne_future = executor.submit(fit_tsne, outputs["embeddings"][:, 0])
 
-        # Save trajectory examples
-        get_embedding_trajectories(outputs["embeddings"][0], outputs["states"][0], f"{output_path}/")
+            # Save trajectory examples, kept on the main thread as pyplot state is not thread-safe
+            get_embedding_trajectories(outputs["embeddings"][0], outputs["states"][0], f"{output_path}/")
 
-        # Get Z0 TSNE
-        tsne = TSNE(n_components=2, perplexity=30, learning_rate=200, n_iter=1000, early_exaggeration=12)
-        fitted = tsne.fit(outputs["embeddings"][:, 0])
-        tsne_embedding = fitted.embedding_
+            # Plot all points in one scatter call, indexing a fixed palette by label
+            tsne_embedding = tsne_future.result()
+            labels = outputs["labels"].astype(int).ravel()
+            classes = np.unique(labels)
+            palette = np.array(plt.get_cmap('tab20').colors)
+            plt.scatter(tsne_embedding[:, 0], tsne_embedding[:, 1], c=palette[labels % len(palette)], s=8)
 
-        for i in np.unique(outputs["labels"]):
-            subset = tsne_embedding[np.where(outputs["labels"] == i)[0], :]
-            plt.scatter(subset[:, 0], subset[:, 1], c=next(plt.gca()._get_lines.prop_cycler)['color'])
+            plt.title("t-SNE Plot of Z0 Embeddings")
+            handles = [Line2D([], [], marker='o', linestyle='', color=palette[c % len(palette)]) for c in classes]
+            plt.legend(handles=handles, labels=[str(c) for c in classes], loc='center left', bbox_to_anchor=(1, 0.5))
+            plt.savefig(f"{output_path}/test_{self.setting}_Z0tsne.png", bbox_inches='tight')
+            plt.close()
 
-        plt.title("t-SNE Plot of Z0 Embeddings")
-        plt.legend(np.unique(outputs["labels"]), loc='center left', bbox_to_anchor=(1, 0.5))
-        plt.savefig(f"{output_path}/test_{self.setting}_Z0tsne.png", bbox_inches='tight')
-        plt.close()
+            # Surface any exceptions raised in the workers
+            for future in futures:
+                future.result()
 
         # Save metrics to JSON in checkpoint folder
         with open(f"{output_path}/test_{self.setting}_metrics.json", 'w') as f:
@@ -52,7 +52,7 @@ class LatentStateEncoder(nn.Module):
             return 0.0
 
         batch_size = self.z_means.shape[0]
-        mus, logvars = self.z_means.view([-1]), self.z_logvs.view([-1])  # N, 2
+        mus, logvars = self.z_means.float().view([-1]), self.z_logvs.float().view([-1])  # N, 2
 
         q = Normal(mus, torch.exp(0.5 * logvars))
         N = Normal(torch.zeros(len(mus), device=mus.device),
@@ -75,7 +75,9 @@ class LatentStateEncoder(nn.Module):
         else:
             z0 = self.deterministic_out(z0)
 
-        return self.out_act(z0)
+        # Return in FP32 so that latent states accumulated by the dynamics (e.g. ODE solver steps) stay in full
+        # precision under mixed-precision training, where the layers above output bf16/fp16
+        return self.out_act(z0).float()
 
 
 class EmissionDecoder(nn.Module):
@@ -94,7 +96,7 @@ class EmissionDecoder(nn.Module):
         self.decoder = nn.Sequential(
             # Transform latent vector into 4D tensor for deconvolution
             nn.Linear(cfg.model.architecture.latent_dim, self.conv_dim),
-            UnFlatten(4),
+            UnFlatten(4, self.conv_dim // 16),
 
             # Perform de-conv to output space
             nn.ConvTranspose2d(self.conv_dim // 16, cfg.model.architecture.num_filters * 4, kernel_size=4, stride=1, padding=(0, 0)),
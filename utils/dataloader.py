@@ -7,7 +7,7 @@ Holds the LightningDataModule for the available datasets
 import torch
 import numpy as np
 import pytorch_lightning
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler, default_convert
 
 
 class SSMDataset(Dataset):
@@ -24,6 +24,10 @@ class SSMDataset(Dataset):
     def __getitem__(self, idx):
         return torch.Tensor([idx]), self.images[idx], self.states[idx], self.controls[idx], self.labels[idx]
 
+    def __getitems__(self, indices):
+        """ Gathers a whole batch with one index into each stacked tensor rather than collating per-sample items """
+        return torch.Tensor(indices).unsqueeze(1), self.images[indices], self.states[indices], self.controls[indices], self.labels[indices]
+
 
 class SSMDataModule(pytorch_lightning.LightningDataModule):
     """ Custom DataModule object that handles preprocessing all sets of data for a given run """
@@ -59,14 +63,23 @@ class SSMDataModule(pytorch_lightning.LightningDataModule):
         # Build dataset and corresponding Dataloader
         dataset = SSMDataset(images, labels, states, controls)
 
-        # If it is the training setting, set up the iterative dataloader
+        # Shared loader options, pinning batches for faster host->device copies and keeping workers alive across epochs
+        loader_kwargs = dict(pin_memory=True, num_workers=self.cfg.training.num_workers,
+                             persistent_workers=self.cfg.training.num_workers > 0)
+
+        # If it is the training setting, set up the iterative sampler
         if mode == "train" and evaluation is False:
-            sampler = torch.utils.data.RandomSampler(dataset, replacement=True, num_samples=self.cfg.training.num_steps * self.cfg.training.batch_size)
-            dataloader = DataLoader(dataset, sampler=sampler, batch_size=self.cfg.training.batch_size, drop_last=True)
+            sampler = RandomSampler(dataset, replacement=True, num_samples=self.cfg.training.num_steps * self.cfg.training.batch_size)
+            drop_last = True
 
-        # Otherwise, setup a normal dataloader
+        # Otherwise, setup a normal sampler
         else:
-            dataloader = DataLoader(dataset, batch_size=self.cfg.training.batch_size, shuffle=shuffle)
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+            drop_last = False
+
+        # Batches come out of SSMDataset.__getitems__ already stacked, so the collate step only passes them through
+        batch_sampler = BatchSampler(sampler, batch_size=self.cfg.training.batch_size, drop_last=drop_last)
+        dataloader = DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=default_convert, **loader_kwargs)
         return dataloader
 
     def train_dataloader(self):
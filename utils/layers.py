@@ -10,7 +10,7 @@ import torch.nn as nn
 class Gaussian(nn.Module):
     def __init__(self, in_dim, out_dim, fix_variance=False):
         """
-        Gaussian sample layer consisting of 2 simple linear layers.
+        Gaussian sample layer consisting of a shared linear trunk and a linear head that outputs both mu and logvar.
         Can choose whether to fix the variance or let it be learned (training instability has been shown when learning).
 
         :param in_dim: input dimension (often a flattened latent embedding from a CNN)
@@ -20,26 +20,20 @@ class Gaussian(nn.Module):
         super(Gaussian, self).__init__()
         self.fix_variance = fix_variance
 
-        # Mean layer
-        self.mu = nn.Sequential(
+        # Hidden layer shared between mu and logvar
+        self.trunk = nn.Sequential(
             nn.Linear(in_dim, in_dim // 2),
-            nn.LeakyReLU(0.1),
-            nn.Linear(in_dim // 2, out_dim)
+            nn.LeakyReLU(0.1)
         )
 
-        # Log-var layer
-        self.logvar = nn.Sequential(
-            nn.Linear(in_dim, in_dim // 2),
-            nn.LeakyReLU(0.1),
-            nn.Linear(in_dim // 2, out_dim)
-        )
+        # Output head for [mu, logvar], or only mu when the variance is fixed
+        self.head = nn.Linear(in_dim // 2, out_dim if fix_variance else 2 * out_dim)
 
     def reparameterize(self, mu, logvar):
-        """ Reparameterization trick to get a sample from the output distribution """
+        """ Reparameterization trick to get a sample from the output distribution, fusing the mul-add via addcmul """
         std = torch.exp(0.5 * logvar)
         noise = torch.randn_like(std)
-        z = mu + (noise * std)
-        return z
+        return torch.addcmul(mu, noise, std)
 
     def forward(self, x):
         """
@@ -47,16 +41,17 @@ class Gaussian(nn.Module):
         :param x: input vector [BatchSize, InputDim]
         """
         # Get mu and logvar
-        mu = self.mu(x)
+        h = self.head(self.trunk(x))
 
         if self.fix_variance:
+            mu = h
             logvar = torch.full_like(mu, fill_value=0.1)
         else:
-            logvar = self.logvar(x)
+            mu, logvar = h.chunk(2, dim=-1)
 
-        # Check on whether mu/logvar are getting out of normal ranges
-        if (mu < -100).any() or (mu > 85).any() or (logvar < -100).any() or (logvar > 85).any():
-            print("Explosion in mu/logvar. Mu {} Logvar {}".format(torch.mean(mu), torch.mean(logvar)))
+        # Keep logvar in a range where exp(0.5 * logvar) is stable, rather than checking for explosions on the host
+        # every step (use torch.autograd.set_detect_anomaly when debugging instabilities)
+        logvar = torch.clamp(logvar, -30, 30)
 
         # Reparameterize and sample
         z = self.reparameterize(mu, logvar)
@@ -66,35 +61,29 @@ class Gaussian(nn.Module):
 class GroupSwish(nn.Module):
     def __init__(self, groups):
         """
-        Swish activation function that works on GroupConvolution by reshaping all input groups back into their
-        batch shapes, activating them, then reshaping them to 1D GroupConv filters
+        Swish activation function for GroupConvolution outputs. As the activation is pointwise, it is applied
+        directly over all groups while preserving the batch dimension
         """
         super().__init__()
         self.silu = nn.SiLU()
         self.groups = groups
 
     def forward(self, x):
-        n_ch_group = x.size(1) // self.groups
-        t = x.shape[2:]
-        x = x.reshape(-1, self.groups, n_ch_group, *t)
-        return self.silu(x).reshape(1, self.groups * n_ch_group, *t)
+        return self.silu(x)
 
 
 class GroupTanh(nn.Module):
     def __init__(self, groups):
         """
-        Tanh activation function that works on GroupConvolution by reshaping all input groups back into their
-        batch shapes, activating them, then reshaping them to 1D GroupConv filters
+        Tanh activation function for GroupConvolution outputs. As the activation is pointwise, it is applied
+        directly over all groups while preserving the batch dimension
         """
         super().__init__()
         self.tanh = nn.Tanh()
         self.groups = groups
 
     def forward(self, x):
-        n_ch_group = x.size(1) // self.groups
-        t = x.shape[2:]
-        x = x.reshape(self.groups, n_ch_group, *t)
-        return self.tanh(x).reshape(1, self.groups * n_ch_group, *t)
+        return self.tanh(x)
 
 
 class Flatten(nn.Module):
@@ -108,15 +97,16 @@ class Flatten(nn.Module):
 
 
 class UnFlatten(nn.Module):
-    def __init__(self, w):
+    def __init__(self, w, nc):
         """
         Handles unflattening a vector into a 4D vector in a nn.Sequential Block
 
         :param w: width of the unflattened image vector
+        :param nc: number of channels of the unflattened image vector
         """
         super().__init__()
         self.w = w
+        self.nc = nc
 
     def forward(self, input):
-        nc = input[0].numel() // (self.w ** 2)
-        return input.view(input.size(0), nc, self.w, self.w)
+        return input.view(input.size(0), self.nc, self.w, self.w)
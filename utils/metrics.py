@@ -33,19 +33,9 @@ def vpt(gt, preds, epsilon=0.010, **kwargs):
     mse = (gt - preds) ** 2
     mse = np.sum(mse, axis=(2, 3)) / (height * width)
 
-    # Get VPT
-    vpts = []
-    for m in mse:
-        # Get all indices below the given epsilon
-        indices = np.where(m < epsilon)[0] + 1
-
-        # If there are none below, then add 0
-        if len(indices) == 0:
-            vpts.append(0)
-            continue
-
-        # Append last in list
-        vpts.append(indices[-1])
+    # Get VPT as the last (1-indexed) timestep below the given epsilon, or 0 if there are none below
+    below = mse < epsilon
+    vpts = np.where(below.any(axis=1), timesteps - np.argmax(below[:, ::-1], axis=1), 0)
 
     # Return VPT mean over the total timesteps
     return np.mean(vpts) / timesteps, np.std(vpts) / timesteps
@@ -190,21 +180,38 @@ def vpd(target, output, epsilon=10, **kwargs):
     return np.mean(vpdist) / T, np.std(vpdist) / T
 
 
+# Metrics that accept either Numpy arrays or Torch tensors, which can be evaluated without a Numpy conversion
+TORCH_METRICS = {"reconstruction_mse", "extrapolation_mse"}
+
+
+def mean_std(values):
+    """ Gets the mean and (population) standard deviation of a Numpy array or Torch tensor as scalars """
+    if isinstance(values, np.ndarray):
+        return np.mean(values), np.std(values)
+    return values.mean().item(), values.std(correction=0).item()
+
+
+def frame_mse(output, target):
+    """ Gets the per-pixel MSE of each frame as a [BatchSize, TimeSteps] array, for Numpy arrays or Torch tensors """
+    return ((output - target) ** 2).mean((2, 3))
+
+
 def reconstruction_mse(output, target, **kwargs):
     """ Gets the mean of the per-pixel MSE for the given length of timesteps used for training """
-    full_pixel_mses = (output[:, :kwargs['cfg'].training.gen_len[kwargs['setting']]] - target[:, :kwargs['cfg'].training.gen_len[kwargs['setting']]]) ** 2
-    sequence_pixel_mse = np.mean(full_pixel_mses, axis=(1, 2, 3))
-    return np.mean(sequence_pixel_mse), np.std(sequence_pixel_mse)
+    frame_mses = kwargs['frame_mse'] if kwargs.get('frame_mse') is not None else frame_mse(output, target)
+    sequence_pixel_mse = frame_mses[:, :kwargs['cfg'].training.gen_len[kwargs['setting']]].mean(1)
+    return mean_std(sequence_pixel_mse)
 
 
 def extrapolation_mse(output, target, **kwargs):
     """ Gets the mean of the per-pixel MSE for a number of steps past the length used in training """
-    full_pixel_mses = (output[:, kwargs['cfg'].training.gen_len.train:] - target[:, kwargs['cfg'].training.gen_len.train:]) ** 2
-    if full_pixel_mses.shape[1] == 0:
+    frame_mses = kwargs['frame_mse'] if kwargs.get('frame_mse') is not None else frame_mse(output, target)
+    frame_mses = frame_mses[:, kwargs['cfg'].training.gen_len.train:]
+    if frame_mses.shape[1] == 0:
         return 0.0, 0.0
 
-    sequence_pixel_mse = np.mean(full_pixel_mses, axis=(1, 2, 3))
-    return np.mean(sequence_pixel_mse), np.std(sequence_pixel_mse)
+    sequence_pixel_mse = frame_mses.mean(1)
+    return mean_std(sequence_pixel_mse)
 
 
 def r2fit(latents, gt_state, mlp=False):
@@ -215,14 +222,10 @@ def r2fit(latents, gt_state, mlp=False):
     :param gt_state: ground truth physical parameters [BatchSize, TimeSteps, StateSize]
     :param mlp: whether to use a non-linear MLP regressor instead of linear regression
     """
-    # Get first dimension of states for evaluation
-    sins = np.sin(gt_state[:, :, 0])
-    coss = np.cos(gt_state[:, :, 0])
-    gt_states = np.stack((sins, coss, gt_state[:, :, 1]), axis=2)
-
     # Ensure on CPU and numpy
     if not isinstance(latents, np.ndarray):
         latents = latents.cpu().numpy()
+    if not isinstance(gt_state, np.ndarray):
         gt_state = gt_state.cpu().numpy()
 
     # Convert to one large set of latent states
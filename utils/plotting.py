@@ -7,7 +7,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 
-def show_images(images, preds, out_loc, num_out=None):
+def show_images(images, preds, out_loc, num_out=None, out=None):
     """
     Constructs an image of multiple time-series reconstruction samples compared against its relevant ground truth
     Saves locally in the given out location
@@ -15,6 +15,8 @@ def show_images(images, preds, out_loc, num_out=None):
     :param preds: predictions from a given model
     :out_loc: where to save the generated image
     :param num_out: how many images to stack. If None, stack all
+    :param out: optional preallocated contiguous array to build the image in, reused across calls.
+                Needs to hold at least num_out * (2H + 20) * Timesteps * (W + 1) elements
     """
     assert len(images.shape) == 4       # Assert both matrices are [Batch, Timesteps, H, W]
     assert len(preds.shape) == 4
@@ -30,35 +32,21 @@ def show_images(images, preds, out_loc, num_out=None):
         images = images[:num_out]
         preds = preds[:num_out]
 
-    # Iterate through each sample, stacking into one image
-    out_image = None
-    for idx, (gt, pred) in enumerate(zip(images, preds)):
-        # Pad between individual timesteps
-        gt = np.pad(gt, pad_width=(
-            (0, 0), (5, 5), (0, 1)
-        ), constant_values=1)
+    # View the buffer as [Sample, GT/Pred, Rows, Timestep, Columns], with each gt/pred frame padded by 10 rows
+    # (5 above and below the gt, 10 below the pred) and 1 column between timesteps
+    num_samples, timesteps, height, width = images.shape
+    size = num_samples * 2 * (height + 10) * timesteps * (width + 1)
+    if out is None:
+        out = np.empty(size, dtype=images.dtype)
+    out_image = out.reshape(-1)[:size].reshape(num_samples, 2, height + 10, timesteps, width + 1)
 
-        gt = np.hstack([i for i in gt])
-
-        # Pad between individual timesteps
-        pred = np.pad(pred, pad_width=(
-            (0, 0), (0, 10), (0, 1)
-        ), constant_values=1)
-
-        # Stack timesteps into one image
-        pred = np.hstack([i for i in pred])
-
-        # Stack gt/pred into one image
-        final = np.vstack((gt, pred))
-
-        # Stack into out_image
-        if out_image is None:
-            out_image = final
-        else:
-            out_image = np.vstack((out_image, final))
+    # Fill in the padding and place every sample's timesteps side-by-side, gt above pred
+    out_image.fill(1)
+    np.copyto(out_image[:, 0, 5:5 + height, :, :width], images.transpose(0, 2, 1, 3))
+    np.copyto(out_image[:, 1, :height, :, :width], preds.transpose(0, 2, 1, 3))
 
     # Save to out location
-    plt.imsave(out_loc, out_image, cmap='gray')
+    plt.imsave(out_loc, out_image.reshape(num_samples * 2 * (height + 10), timesteps * (width + 1)), cmap='gray')
 
 
 def get_embedding_trajectories(embeddings, states, out_loc):
@@ -5,6 +5,7 @@ Utility functions across files
 """
 import os
 import math
+import torch
 import numpy as np
 import torch.nn as nn
 
@@ -160,6 +161,34 @@ def determine_annealing_factor(n_updates, min_anneal_factor=0.0, anneal_update=1
     return anneal_factor
 
 
+def fit_tsne(embeddings, perplexity=30, learning_rate=200, n_iter=1000, early_exaggeration=12):
+    """
+    Fits a 2D t-SNE over the given vectors, using cuML's GPU TSNE when it is installed and CUDA is available
+    and otherwise openTSNE's multi-threaded FFT-accelerated TSNE
+    :param embeddings: vectors to embed [N, Dim]
+    :return: 2D embedding as a Numpy array [N, 2]
+    """
+    tsne_kwargs = dict(n_components=2, perplexity=perplexity, learning_rate=learning_rate,
+                       n_iter=n_iter, early_exaggeration=early_exaggeration)
+
+    # Both backends work over a contiguous float32 array
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    # GPU TSNE
+    if torch.cuda.is_available():
+        try:
+            from cuml.manifold import TSNE
+            return TSNE(**tsne_kwargs).fit_transform(embeddings)
+        except ImportError:
+            pass
+
+    # Multi-threaded CPU TSNE, which returns the embedding directly from fit
+    # openTSNE's n_iter excludes the early exaggeration phase, so it is taken out to match the other backends' total
+    from openTSNE import TSNE
+    tsne_kwargs.update(early_exaggeration_iter=250, n_iter=n_iter - 250)
+    return np.asarray(TSNE(**tsne_kwargs, n_jobs=-1, negative_gradient_method='fft').fit(embeddings))
+
+
 def strtobool(val):
     """Convert a string representation of truth to true (1) or false (0).
     True values are 'y', 'yes', 't', 'true', 'on', and '1'; false values